@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Pull faction members (API v2) and each member's Xanax taken (xantaken),
-then write results to a dated CSV.
+then write results to a dated CSV (and optionally a Parquet copy for xantaken_diff.py).
 
 Endpoints used:
 - GET https://api.torn.com/v2/faction/{faction_id}/members
@@ -15,67 +15,157 @@ import csv
 import datetime as dt
 import os
 import sys
+import threading
 import time
-from typing import Any, Dict, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, List, Mapping, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 
 BASE_URL = "https://api.torn.com/v2"
+FIELDS = ("user_id", "name", "position", "level", "xantaken", "export_date")
+HEADERS = {
+    "Accept": "application/json",
+    "User-Agent": "faction-xantaken-export/1.0",
+}
+
+class TransportRetry(Retry):
+    # urllib3 retries any Retry-After status on its own, even outside status_forcelist.
+    # 429 is left to torn_get, which backs off through the shared RateLimiter so every worker pauses.
+    RETRY_AFTER_STATUS_CODES = frozenset({413, 503})
+
+
+# Transport-level retries done by urllib3 on the session adapter, honouring Retry-After for 5xx
+TRANSPORT_RETRY = TransportRetry(
+    total=5,
+    backoff_factor=1.7,
+    status_forcelist=[500, 502, 503, 504],
+    allowed_methods=["GET"],
+    respect_retry_after_header=True,
+    # Hand the last 5xx back to torn_get so its headers reach the shared RateLimiter
+    raise_on_status=False,
+)
+
+# Torn allows 100 requests per rolling minute per user (across all keys)
+RATE_LIMIT_CALLS = 100
+RATE_LIMIT_PERIOD = 60.0
+
+
+class RateLimiter:
+    """
+    Thread-safe rolling-window limiter: at most `calls` requests in any `period` seconds.
+    acquire() only sleeps when the window is full, or when the server asked us to back off.
+    """
+
+    def __init__(self, calls: int = RATE_LIMIT_CALLS, period: float = RATE_LIMIT_PERIOD) -> None:
+        self.calls = calls
+        self.period = period
+        self.stamps: Deque[float] = deque()
+        self.resume_at = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.stamps and self.stamps[0] <= now - self.period:
+                    self.stamps.popleft()
+
+                if now < self.resume_at:
+                    wait = self.resume_at - now
+                elif len(self.stamps) < self.calls:
+                    self.stamps.append(now)
+                    return
+                else:
+                    wait = self.stamps[0] + self.period - now
+            time.sleep(wait)
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        """Honour Retry-After / X-RateLimit-* response headers when the server sends them."""
+        retry_after = headers.get("Retry-After")
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+
+        pause: Optional[float] = None
+        try:
+            if retry_after is not None:
+                pause = float(retry_after)
+            elif remaining is not None and int(remaining) <= 0:
+                pause = float(reset) if reset is not None else self.period
+                # Some servers send an epoch timestamp rather than a delta
+                if pause > 1e9:
+                    pause -= time.time()
+        except ValueError:
+            return
+
+        if pause:
+            self.pause(pause)
+
+    def pause(self, seconds: float) -> None:
+        """Hold every acquire() for at least `seconds`, so the whole worker pool backs off together."""
+        if seconds > 0:
+            with self.lock:
+                self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+
+def _back_off(limiter: Optional[RateLimiter], seconds: float) -> None:
+    """Pause the whole pool through the shared limiter, or just this thread without one."""
+    if limiter is not None:
+        limiter.pause(seconds)
+    else:
+        time.sleep(seconds)
 
 
 def torn_get(
     session: requests.Session,
     url: str,
     *,
-    api_key: str,
     params: Optional[Dict[str, Any]] = None,
     timeout: int = 30,
     max_retries: int = 5,
+    limiter: Optional[RateLimiter] = None,
 ) -> Dict[str, Any]:
     """
-    GET wrapper with basic retry/backoff.
-    Torn can return errors in-body (e.g. error.code == 5 for rate limit).
+    GET wrapper for rate limiting and Torn's in-body errors.
+    Connection errors and 5xx are retried by the session's adapter (TRANSPORT_RETRY);
+    HTTP 429 and Torn error code 5 are retried here with backoff.
+    The session is expected to carry the Authorization header.
+    If a limiter is given, each call here is counted against it (the adapter's own 5xx retries are not),
+    response headers are fed back to it, and rate-limit backoff pauses every worker rather than one thread.
     """
-    headers = {
-        "Authorization": f"ApiKey xOZ42wvjt01rhnl9",
-        "Accept": "application/json",
-        "User-Agent": "faction-xantaken-export/1.0",
-    }
-
     backoff = 2.0
     last_err: Optional[str] = None
 
     for attempt in range(1, max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+
         try:
-            r = session.get(url, headers=headers, params=params, timeout=timeout)
+            r = session.get(url, params=params, timeout=timeout)
         except requests.RequestException as e:
-            last_err = f"Request failed: {e}"
-            time.sleep(backoff)
-            backoff *= 1.7
-            continue
+            raise RuntimeError(f"Request failed: {e}") from e
+
+        if limiter is not None:
+            limiter.observe(r.headers)
 
-        # HTTP-level rate limiting
+        # HTTP-level rate limiting; observe() above already applied any Retry-After
         if r.status_code == 429:
             last_err = "HTTP 429 rate limited"
-            time.sleep(backoff)
+            _back_off(limiter, backoff)
             backoff *= 1.7
             continue
 
-        # Non-OK HTTP
-        if not (200 <= r.status_code < 300):
-            last_err = f"HTTP {r.status_code}: {r.text[:200]}"
-            time.sleep(backoff)
-            backoff *= 1.7
-            continue
+        if not r.ok:
+            raise RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
 
         try:
             data = r.json()
         except ValueError:
-            last_err = f"Non-JSON response: {r.text[:200]}"
-            time.sleep(backoff)
-            backoff *= 1.7
-            continue
+            raise RuntimeError(f"Non-JSON response: {r.text[:200]}")
 
         # Torn-style error in JSON body
         if isinstance(data, dict) and "error" in data:
@@ -86,7 +176,8 @@ def torn_get(
             # Code 5 is "Too many requests" (100/min rolling limit)
             if code == 5:
                 last_err = f"Torn error code 5 (rate limit): {msg}"
-                time.sleep(backoff)
+                # Torn reports this in-body on an HTTP 200 with no rate-limit headers
+                _back_off(limiter, backoff)
                 backoff *= 1.7
                 continue
 
@@ -97,91 +188,134 @@ def torn_get(
     raise RuntimeError(last_err or "Failed after retries")
 
 
-def get_faction_members(session: requests.Session, api_key: str, faction_id: int) -> List[Dict[str, Any]]:
+def get_faction_members(
+    session: requests.Session,
+    faction_id: int,
+    limiter: Optional[RateLimiter] = None,
+) -> List[Dict[str, Any]]:
     url = f"{BASE_URL}/faction/{faction_id}/members"
-    data = torn_get(session, url, api_key=api_key, params={"striptags": "true"})
+    data = torn_get(session, url, params={"striptags": "true"}, limiter=limiter)
     members = data.get("members")
     if not isinstance(members, list):
         raise RuntimeError(f"Unexpected members payload shape: {type(members)}")
     return members
 
 
-def get_member_xantaken(session: requests.Session, api_key: str, user_id: int) -> Optional[int]:
+def get_member_xantaken(
+    session: requests.Session,
+    user_id: int,
+    limiter: Optional[RateLimiter] = None,
+) -> Optional[int]:
     url = f"{BASE_URL}/user/{user_id}/personalstats"
-    data = torn_get(session, url, api_key=api_key, params={"stat": "xantaken"})
-    ps = data.get("personalstats", {})
-    per_stats = ps.pop()
-    val = per_stats.get("value")
+    data = torn_get(session, url, params={"stat": "xantaken"}, limiter=limiter)
+    ps = data.get("personalstats")
+    # ?stat= returns a list of {"name", "value", "timestamp"}; older shapes are a flat dict
+    if isinstance(ps, list):
+        val = next((s.get("value") for s in ps if isinstance(s, dict) and s.get("name") == "xantaken"), None)
+    elif isinstance(ps, dict):
+        val = ps.get("xantaken")
+    else:
+        val = None
     return int(val) if isinstance(val, (int, float)) else None
 
 
+def write_parquet(rows: List[Tuple[Any, ...]], path: str) -> None:
+    """Typed columnar copy of the export so xantaken_diff.py can skip CSV parsing (needs pandas + pyarrow)."""
+    import pandas as pd
+
+    df = pd.DataFrame(rows, columns=list(FIELDS)).astype({"xantaken": "float64"})
+    df.to_parquet(path, index=False, engine="pyarrow")
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(description="Export faction members + xantaken to dated CSV.")
     parser.add_argument("--key", default=os.getenv("TORN_API_KEY"), help="Torn API key (or set TORN_API_KEY env var)")
     parser.add_argument("--faction-id", type=int, default=22631, help="Faction ID (default: 22631)")
     parser.add_argument(
-        "--sleep",
-        type=float,
-        default=0.75,
-        help="Seconds to sleep between member personalstats calls (default: 0.75)",
+        "--workers",
+        type=int,
+        default=8,
+        help="Concurrent member personalstats calls (default: 8)",
     )
     parser.add_argument(
         "--outdir",
         default=".",
         help="Output directory (default: current directory)",
     )
+    parser.add_argument(
+        "--parquet",
+        action="store_true",
+        help="Also write a .parquet copy next to the CSV (requires pandas + pyarrow)",
+    )
     args = parser.parse_args()
 
     if not args.key:
         print("ERROR: Missing API key. Pass --key or set TORN_API_KEY.", file=sys.stderr)
         return 2
 
+    if args.parquet:
+        # Fail before the (rate-limited) member fetch rather than at write time
+        try:
+            import pandas  # noqa: F401
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("ERROR: --parquet requires pandas and pyarrow to be installed.", file=sys.stderr)
+            return 2
+
     today = dt.date.today().isoformat()
     out_path = os.path.join(args.outdir, f"faction_{args.faction_id}_xantaken_{today}.csv")
 
-    with requests.Session() as session:
-        members = get_faction_members(session, args.key, args.faction_id)
+    workers = max(1, args.workers)
 
-        rows: List[Dict[str, Any]] = []
-        for i, m in enumerate(members, start=1):
+    with requests.Session() as session:
+        # One keep-alive pool for every call. Each worker holds its own persistent connection,
+        # so the pool must be at least as large as the worker count or connections get discarded.
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=max(32, workers), max_retries=TRANSPORT_RETRY)
+        session.mount("https://", adapter)
+        session.headers.update(HEADERS)
+        session.headers["Authorization"] = f"ApiKey {args.key}"
+
+        # Shared by the members call and every personalstats call (retries included)
+        limiter = RateLimiter()
+        members = get_faction_members(session, args.faction_id, limiter)
+
+        def fetch_row(m: Dict[str, Any]) -> Tuple[Any, ...]:
             user_id = int(m.get("id"))
-            name = m.get("name")
-            position = m.get("position")
-            level = m.get("level")
 
             xantaken = None
             err = ""
             try:
-                xantaken = get_member_xantaken(session, args.key, user_id)
+                xantaken = get_member_xantaken(session, user_id, limiter)
             except Exception as e:
                 err = str(e)
 
-            rows.append(
-                {
-                    "user_id": user_id,
-                    "name": name,
-                    "position": position,
-                    "level": level,
-                    "xantaken": xantaken,
-                    "export_date": today
-                }
-            )
-
-            # Throttle (helps stay under the 100/min rolling limit)
-            if args.sleep > 0:
-                time.sleep(args.sleep)
-
-    # Write CSV
-    os.makedirs(args.outdir, exist_ok=True)
-    with open(out_path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(
-            f,
-            fieldnames=["user_id", "name", "position", "level", "xantaken", "export_date"],
-        )
-        writer.writeheader()
-        writer.writerows(rows)
-
-    print(f"Wrote {len(rows)} members to: {out_path}")
+            # Same order as FIELDS
+            return (user_id, m.get("name"), m.get("position"), m.get("level"), xantaken, today)
+
+        # Stream rows to disk as they arrive instead of buffering the whole faction
+        os.makedirs(args.outdir, exist_ok=True)
+        written = 0
+        rows: List[Tuple[Any, ...]] = []
+        with open(out_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(FIELDS)
+
+            # Calls are I/O bound; the limiter in torn_get keeps the pool under the 100/min rolling limit.
+            # pool.map yields in member order, each row as soon as it (and those before it) are done.
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for written, row in enumerate(pool.map(fetch_row, members), start=1):
+                    writer.writerow(row)
+                    if args.parquet:
+                        rows.append(row)
+                    if written % 25 == 0:
+                        f.flush()
+
+    print(f"Wrote {written} members to: {out_path}")
+
+    if args.parquet:
+        parquet_path = os.path.splitext(out_path)[0] + ".parquet"
+        write_parquet(rows, parquet_path)
+        print(f"Wrote {len(rows)} members to: {parquet_path}")
     return 0
 
 
@@ -7,6 +7,9 @@ Compare two Torn faction Xanax-taken snapshot CSVs and produce a per-user report
 Input CSVs are expected to look like:
     user_id,name,position,level,xantaken,export_date
 
+Parquet snapshots (xans.py --parquet) with the same columns are also accepted and
+load without any CSV parsing.
+
 Output includes:
 - xantaken_a (from file1)
 - xantaken_b (from file2)
@@ -16,6 +19,7 @@ Output includes:
 Usage:
   python xantaken_diff.py path/to/snap1.csv path/to/snap2.csv
   python xantaken_diff.py snap1.csv snap2.csv --output report.csv
+  python xantaken_diff.py snap1.parquet snap2.parquet
 
 Notes:
 - days_between_exports is computed from export_date (preferred) or a YYYY-MM-DD in the filename.
@@ -26,6 +30,7 @@ from __future__ import annotations
 
 import argparse
 import re
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import date
 from pathlib import Path
@@ -37,6 +42,18 @@ import pandas as pd
 
 DATE_RE = re.compile(r"(\d{4}-\d{2}-\d{2})")
 
+# Torn's fixed faction ranks; faction-defined positions sort alphabetically between them
+LEADER_POSITIONS = ("Leader", "Co-leader")
+RECRUIT_POSITION = "Recruit"
+
+
+def _position_categorical(positions: pd.Series) -> pd.Categorical:
+    """Ordered categorical so sorting by position follows the faction hierarchy (and runs on int codes)."""
+    fixed = set(LEADER_POSITIONS) | {RECRUIT_POSITION}
+    custom = sorted((p for p in positions.dropna().unique() if p not in fixed), key=str)
+    categories = [*LEADER_POSITIONS, *custom, RECRUIT_POSITION]
+    return pd.Categorical(positions, categories=categories, ordered=True)
+
 
 def _parse_date_from_df_or_filename(df: pd.DataFrame, path: Path) -> Optional[date]:
     """Try export_date column first, then fall back to parsing YYYY-MM-DD from filename."""
@@ -44,11 +61,24 @@ def _parse_date_from_df_or_filename(df: pd.DataFrame, path: Path) -> Optional[da
         # Use the first non-null value; files are usually single-day exports.
         series = df["export_date"].dropna()
         if not series.empty:
+            value = series.iloc[0]
+            # Exports are written as YYYY-MM-DD; only hand other formats to pandas' parser
+            if isinstance(value, str):
+                try:
+                    return date.fromisoformat(value)
+                except ValueError:
+                    pass
             try:
-                return pd.to_datetime(series.iloc[0]).date()
+                return pd.to_datetime(value).date()
             except Exception:
                 pass
 
+    # xans.py names files ..._YYYY-MM-DD.csv, so try the fixed-position slice before the regex
+    try:
+        return date.fromisoformat(path.stem[-10:])
+    except ValueError:
+        pass
+
     m = DATE_RE.search(path.name)
     if m:
         try:
@@ -60,7 +90,11 @@ def _parse_date_from_df_or_filename(df: pd.DataFrame, path: Path) -> Optional[da
 
 
 def _load_snapshot(path: Path) -> pd.DataFrame:
-    df = pd.read_csv(path)
+    if path.suffix.lower() == ".parquet":
+        df = pd.read_parquet(path)
+    else:
+        # user_id is typed in the C parser; xantaken is coerced below so unreadable cells become NaN
+        df = pd.read_csv(path, dtype={"user_id": str})
 
     required = {"user_id", "xantaken"}
     missing = required - set(df.columns)
@@ -70,17 +104,19 @@ def _load_snapshot(path: Path) -> pd.DataFrame:
             f"Found columns: {', '.join(df.columns)}"
         )
 
-    # Normalize types
-    df = df.copy()
-    df["user_id"] = df["user_id"].astype(str)
+    if path.suffix.lower() == ".parquet":
+        # Parquet keeps user_id as an integer; match the CSV path so the join keys line up
+        df["user_id"] = df["user_id"].astype(str)
+
     df["xantaken"] = pd.to_numeric(df["xantaken"], errors="coerce")
 
     return df
 
 
 def build_report(path_a: Path, path_b: Path) -> Tuple[pd.DataFrame, Optional[date], Optional[date], Optional[int]]:
-    df_a = _load_snapshot(path_a)
-    df_b = _load_snapshot(path_b)
+    # The two reads are independent and pandas' C parser releases the GIL
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        df_a, df_b = ex.map(_load_snapshot, [path_a, path_b])
 
     date_a = _parse_date_from_df_or_filename(df_a, path_a)
     date_b = _parse_date_from_df_or_filename(df_b, path_b)
@@ -99,54 +135,63 @@ def build_report(path_a: Path, path_b: Path) -> Tuple[pd.DataFrame, Optional[dat
     # Keep common metadata if present
     meta_cols = [c for c in ["name", "position", "level"] if (c in df_a.columns or c in df_b.columns)]
 
-    keep_a = ["user_id", "xantaken"] + [c for c in meta_cols if c in df_a.columns]
-    keep_b = ["user_id", "xantaken"] + [c for c in meta_cols if c in df_b.columns]
+    keep_a = ["xantaken"] + [c for c in meta_cols if c in df_a.columns]
+    keep_b = ["xantaken"] + [c for c in meta_cols if c in df_b.columns]
 
-    a = df_a[keep_a].copy()
-    b = df_b[keep_b].copy()
+    # Project + suffix in one step and join on the index; no intermediate copies or renames
+    a = df_a.set_index("user_id")[keep_a].add_suffix("_a")
+    b = df_b.set_index("user_id")[keep_b].add_suffix("_b")
 
-    a = a.rename(columns={"xantaken": "xantaken_a", **{c: f"{c}_a" for c in meta_cols if c in a.columns}})
-    b = b.rename(columns={"xantaken": "xantaken_b", **{c: f"{c}_b" for c in meta_cols if c in b.columns}})
-
-    merged = a.merge(b, on="user_id", how="outer")
+    merged = a.join(b, how="outer").reset_index()
 
     # Prefer metadata from file2 when available; fall back to file1
     for c in meta_cols:
         ca, cb = f"{c}_a", f"{c}_b"
         if cb in merged.columns and ca in merged.columns:
-            merged[c] = merged[cb].combine_first(merged[ca])
+            ca_v, cb_v = merged[ca].to_numpy(), merged[cb].to_numpy()
+            merged[c] = np.where(pd.notna(cb_v), cb_v, ca_v)
         elif cb in merged.columns:
             merged[c] = merged[cb]
         elif ca in merged.columns:
             merged[c] = merged[ca]
 
-    merged["diff_xantaken"] = merged["xantaken_b"] - merged["xantaken_a"]
-    merged["xantaken_min"] = merged[["xantaken_a", "xantaken_b"]].min(axis=1)
-    merged["xantaken_max"] = merged[["xantaken_a", "xantaken_b"]].max(axis=1)
+    # diff keeps the columns' native dtype so whole-number snapshots stay integers in the report
+    a_raw = merged["xantaken_a"].to_numpy()
+    b_raw = merged["xantaken_b"].to_numpy()
+    diff = b_raw - a_raw
 
-    if days_between is None or days_between == 0:
-        merged["avg_xantaken_per_day"] = np.nan
-    else:
-        merged["avg_xantaken_per_day"] = (merged["xantaken_max"] - merged["xantaken_min"]) / (days_between)
+    # float64 for the NaN-aware parts; fmin/fmax skip NaN like DataFrame.min/max(axis=1)
+    a_arr = a_raw.astype(np.float64, copy=False)
+    b_arr = b_raw.astype(np.float64, copy=False)
+    xmin = np.fmin(a_arr, b_arr)
+    xmax = np.fmax(a_arr, b_arr)
+
+    if days_between:
+        avg = (xmax - xmin) / days_between
         # We subtract 1 from the given days since there is a 1 day delay in the API
+    else:
+        avg = np.full(len(merged), np.nan)
 
-    def _status(row: pd.Series) -> str:
-        a_missing = pd.isna(row["xantaken_a"])
-        b_missing = pd.isna(row["xantaken_b"])
-        avg_xan_taken = row["avg_xantaken_per_day"]
-        if a_missing and b_missing:
-            return "Never Taken Xan!!!"
-        if a_missing:
-            return "New Recruit"
-        if b_missing:
-            return "Not in Faction and Time of Second Snapshot"
-        if avg_xan_taken < 1:
-            return "Fail"
-        if avg_xan_taken >= 2:
-            return "Exceeds"
-        return "Pass"
-
-    merged["status"] = merged.apply(_status, axis=1)
+    merged = merged.assign(
+        diff_xantaken=diff,
+        xantaken_min=xmin,
+        xantaken_max=xmax,
+        avg_xantaken_per_day=avg,
+    )
+
+    # Later masks take precedence, mirroring the if-chain: missing snapshots beat the averages
+    a_missing = np.isnan(a_arr)
+    b_missing = np.isnan(b_arr)
+
+    status = np.full(len(merged), "Pass", dtype=object)
+    # Without a day span the average is all-NaN and neither threshold can match
+    if days_between:
+        status[avg < 1] = "Fail"
+        status[avg >= 2] = "Exceeds"
+    status[b_missing] = "Not in Faction and Time of Second Snapshot"
+    status[a_missing] = "New Recruit"
+    status[a_missing & b_missing] = "Never Taken Xan!!!"
+    merged["status"] = status
     #merged["start_date"] = str(start_date) if start_date else ""
     #merged["end_date"] = str(end_date) if end_date else ""
     #merged["days_between"] = days_between if days_between is not None else ""
@@ -159,9 +204,15 @@ def build_report(path_a: Path, path_b: Path) -> Tuple[pd.DataFrame, Optional[dat
     )
     out_cols = [c for c in out_cols if c in merged.columns]
 
+    # position is optional metadata; only sort by it when a snapshot provided it
+    sort_by, ascending = ["diff_xantaken", "user_id"], [False, True]
+    if "position" in merged.columns:
+        merged["position"] = _position_categorical(merged["position"])
+        sort_by, ascending = ["position", *sort_by], [True, *ascending]
+
     report = merged[out_cols].sort_values(
-        by=["position", "diff_xantaken", "user_id"],
-        ascending=[True, False, True],
+        by=sort_by,
+        ascending=ascending,
         na_position="last",
     )
 
@@ -170,8 +221,8 @@ def build_report(path_a: Path, path_b: Path) -> Tuple[pd.DataFrame, Optional[dat
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Compare two xantaken snapshot CSVs and write a diff report.")
-    parser.add_argument("file1", type=Path, help="Path to the earlier (or first) snapshot CSV")
-    parser.add_argument("file2", type=Path, help="Path to the later (or second) snapshot CSV")
+    parser.add_argument("file1", type=Path, help="Path to the earlier (or first) snapshot CSV or Parquet file")
+    parser.add_argument("file2", type=Path, help="Path to the later (or second) snapshot CSV or Parquet file")
     parser.add_argument(
         "-o",
         "--output",